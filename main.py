@@ -1,20 +1,26 @@
+import asyncio
 import os
 import secrets
-import traceback
-from datetime import datetime, timedelta, timezone
-from typing import Optional, Literal, Any, Dict, List
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
+from typing import Annotated, Any, Dict, List, Optional, Literal
 
-import psycopg
-from psycopg.errors import UniqueViolation
-from fastapi import FastAPI, HTTPException
+import anyio.to_thread
+from psycopg.rows import dict_row
+from fastapi import FastAPI, HTTPException, Query
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, Field, StringConstraints
 
 # =========================
 # CONFIG (SEM LICENÇA)
 # =========================
 ADMIN_API_KEY = (os.getenv("ADMIN_API_KEY") or "dev_key").strip()
 DATABASE_URL = (os.getenv("DATABASE_URL") or "").strip()
+DEFAULT_DURATION_HOURS = 48
+THREADPOOL_SIZE = int(os.getenv("THREADPOOL_SIZE") or 0)  # 0 = padrão do anyio (40)
+DB_PROBE_INTERVAL_SECONDS = max(1.0, float(os.getenv("DB_PROBE_INTERVAL_SECONDS") or 5))
 
 
 def utcnow() -> datetime:
@@ -25,28 +31,59 @@ def connect_db():
     raise Exception("DB desativado")
 
 
-def fetchone_dict(cur) -> Optional[Dict[str, Any]]:
-    row = cur.fetchone()
-    if not row:
-        return None
-    cols = [d.name for d in cur.description]
-    return dict(zip(cols, row))
-
-
-def fetchall_dict(cur) -> List[Dict[str, Any]]:
-    rows = cur.fetchall() or []
-    cols = [d.name for d in cur.description]
-    return [dict(zip(cols, r)) for r in rows]
+def gen_license_key() -> str:
+    return secrets.token_hex(16)
 
 
-def gen_license_key() -> str:
-    return secrets.token_urlsafe(18).replace("-", "").replace("_", "")
+# =========================
+# SQL
+# =========================
+SQL_PING = "SELECT 1;"
+
+SQL_INSERT_LICENSE = """
+    INSERT INTO public.licenses
+      (license_key, license_type, status, duration_hours, created_at)
+    VALUES (%s, %s, %s, %s, %s)
+    ON CONFLICT DO NOTHING
+    RETURNING license_key;
+"""
+
+# SELECT * de propósito: o schema fica fora deste repo e a listagem admin
+# devolve a linha completa.
+SQL_LIST_LICENSES = """
+    SELECT *
+    FROM public.licenses
+    ORDER BY created_at DESC, license_key DESC
+    LIMIT %s OFFSET %s;
+"""
 
 
 LicenseType = Literal["trial", "monthly"]
 LicenseStatus = Literal["active", "blocked", "expired", "canceled"]
 
-app = FastAPI(title="Prospecta Backend", version="2.0.2")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if THREADPOOL_SIZE > 0:
+        anyio.to_thread.current_default_thread_limiter().total_tokens = THREADPOOL_SIZE
+    app.state.db_health = await anyio.to_thread.run_sync(probe_db)
+    prober = asyncio.create_task(db_prober(app))
+    try:
+        yield
+    finally:
+        prober.cancel()
+        with suppress(asyncio.CancelledError):
+            await prober
+
+
+app = FastAPI(
+    title="Prospecta Backend",
+    version="2.0.2",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+# valor até o primeiro probe (ou se o lifespan estiver desligado)
+app.state.db_health = {"ok": False, "detail": "probe pending"}
 
 # =========================
 # CORS
@@ -59,11 +96,23 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# =========================
+# COMPRESSION
+# =========================
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
 # =========================
 # MODELS
 # =========================
-class AdminCreateLicense(BaseModel):
-    api_key: str
+NonEmptyStr = Annotated[
+    str, StringConstraints(strip_whitespace=True, min_length=1, max_length=128)
+]
+ApiKeyStr = Annotated[str, StringConstraints(max_length=128)]
+
+
+class AdminLicenseSpec(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+
     license_type: LicenseType = "trial"
     duration_hours: Optional[int] = None
     license_key: Optional[str] = None
@@ -71,106 +120,184 @@ class AdminCreateLicense(BaseModel):
     buyer_email: Optional[str] = None
 
 
+class AdminCreateLicense(AdminLicenseSpec):
+    api_key: ApiKeyStr
+
+
+class AdminCreateLicenses(BaseModel):
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+
+    api_key: ApiKeyStr
+    licenses: List[AdminLicenseSpec] = Field(..., min_length=1, max_length=1000)
+
+
 class AdminResetLicense(BaseModel):
-    api_key: str
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+
+    api_key: ApiKeyStr
     license_key: str
 
 
 class AdminRevokeLicense(BaseModel):
-    api_key: str
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+
+    api_key: ApiKeyStr
     license_key: str
     status: LicenseStatus = "blocked"
 
 
 class ActivateRequest(BaseModel):
-    license_key: str = Field(..., min_length=1)
-    device_id: str = Field(..., min_length=1)
+    model_config = ConfigDict(str_strip_whitespace=True, frozen=True)
+
+    license_key: NonEmptyStr
+    device_id: NonEmptyStr
     buyer_email: Optional[str] = None
 
 
 # =========================
 # HEALTH
 # =========================
-@app.get("/health")
-def health():
+def probe_db() -> Dict[str, Any]:
     try:
         with connect_db() as conn:
             with conn.cursor() as cur:
-                cur.execute("SELECT 1;")
+                cur.execute(SQL_PING)
                 cur.fetchone()
         return {"ok": True}
     except Exception as e:
         return {"ok": False, "detail": str(e)}
 
 
-@app.get("/health")
-def health():
+async def db_prober(app: FastAPI):
+    while True:
+        await asyncio.sleep(DB_PROBE_INTERVAL_SECONDS)
+        app.state.db_health = await anyio.to_thread.run_sync(probe_db)
+
+
+@app.get("/livez")
+async def livez():
     return {"ok": True}
 
 
+@app.get("/health")
+async def health():
+    return app.state.db_health
+
+
 # =========================
 # ADMIN (SEM AUTH)
 # =========================
+def license_insert_params(spec: AdminLicenseSpec, created_at: datetime) -> tuple:
+    return (
+        spec.license_key or gen_license_key(),
+        spec.license_type,
+        spec.status,
+        spec.duration_hours or DEFAULT_DURATION_HOURS,
+        created_at,
+    )
+
+
 @app.post("/admin/create-license")
 def admin_create_license(data: AdminCreateLicense):
-    key = (data.license_key or "").strip() or gen_license_key()
+    with connect_db() as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.execute(SQL_INSERT_LICENSE, license_insert_params(data, utcnow()))
+            row = cur.fetchone()
 
-    try:
-        with connect_db() as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    INSERT INTO public.licenses
-                      (license_key, license_type, status, duration_hours, created_at)
-                    VALUES (%s, %s, %s, %s, %s)
-                    RETURNING license_key;
-                    """,
-                    (
-                        key,
-                        data.license_type,
-                        data.status,
-                        data.duration_hours or 48,
-                        utcnow(),
-                    ),
-                )
-                row = fetchone_dict(cur)
-        return {"ok": True, "license": row}
-
-    except UniqueViolation:
+    if not row:
         raise HTTPException(status_code=400, detail="Licença já existe")
+    return {"ok": True, "license": row}
+
+
+@app.post("/admin/create-licenses")
+def admin_create_licenses(data: AdminCreateLicenses):
+    # mesmo created_at para o lote inteiro (de propósito: foi uma única
+    # criação); a listagem desempata por license_key
+    now = utcnow()
+    params = [license_insert_params(spec, now) for spec in data.licenses]
+    created, skipped = [], []
+
+    with connect_db() as conn:
+        with conn.cursor(row_factory=dict_row) as cur:
+            cur.executemany(SQL_INSERT_LICENSE, params, returning=True)
+            # um result set por linha; vazio quando a chave já existia
+            for p in params:
+                row = cur.fetchone()
+                if row:
+                    created.append(row["license_key"])
+                else:
+                    skipped.append(p[0])
+                cur.nextset()
+
+    return {"ok": True, "created": created, "skipped": skipped}
 
 
 @app.get("/admin/licenses")
-def admin_list_licenses():
+def admin_list_licenses(
+    limit: int = Query(100, ge=1, le=1000),
+    offset: int = Query(0, ge=0),
+):
     with connect_db() as conn:
-        with conn.cursor() as cur:
-            cur.execute("SELECT * FROM public.licenses ORDER BY created_at DESC;")
-            items = fetchall_dict(cur)
-    return {"ok": True, "items": items}
+        with conn.cursor(row_factory=dict_row) as cur:
+            # uma linha extra só para saber se há próxima página
+            cur.execute(SQL_LIST_LICENSES, (limit + 1, offset))
+            items = cur.fetchall()
+
+    has_more = len(items) > limit
+    return {
+        "ok": True,
+        "items": items[:limit],
+        "limit": limit,
+        "offset": offset,
+        "has_more": has_more,
+    }
 
 
 # =========================
 # LICENÇA DESATIVADA
 # =========================
 @app.post("/license/activate")
-def activate_license(data: ActivateRequest):
+async def activate_license(data: ActivateRequest):
     return {
         "ok": True,
         "valid": True,
         "license_key": data.license_key,
         "device_id": data.device_id,
-        "activated_at": utcnow().isoformat(),
+        "activated_at": utcnow(),
         "expires_at": None,
     }
 
 
 @app.get("/license/validate")
-def validate_license(key: str, device_id: str, buyer_email: Optional[str] = None):
+async def validate_license(
+    key: Annotated[NonEmptyStr, Query()],
+    device_id: Annotated[NonEmptyStr, Query()],
+    buyer_email: Optional[str] = None,
+):
     return {
         "ok": True,
         "valid": True,
         "license_key": key,
         "device_id": device_id,
-        "activated_at": utcnow().isoformat(),
+        "activated_at": utcnow(),
         "expires_at": None,
     }
+
+
+# =========================
+# RUN
+# =========================
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(
+        "main:app",
+        host="0.0.0.0",
+        port=int(os.getenv("PORT") or 8000),
+        loop="uvloop",
+        http="httptools",
+        workers=int(os.getenv("WEB_CONCURRENCY") or os.cpu_count() or 1),
+        limit_concurrency=int(os.getenv("LIMIT_CONCURRENCY") or 200),
+        timeout_keep_alive=int(os.getenv("KEEP_ALIVE_TIMEOUT") or 75),
+        access_log=False,
+    )